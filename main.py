@@ -1,8 +1,17 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+import asyncio
 import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import orjson
 from dotenv import load_dotenv
 from langgraph.errors import GraphRecursionError
+from pydantic import TypeAdapter
 
 from models import ChatRequest, ChatResponse, ExtractedInfo, FlightResult, DetailedOffer
 from graph import create_flight_search_graph, initialize_state_from_request
@@ -29,6 +38,46 @@ app.add_middleware(
 # Compile LangGraph workflow
 graph = create_flight_search_graph().compile()
 
+# Conversation history per thread_id, for clients that let the server keep it.
+# Ids are random uuid4s issued by the server, never chosen by clients, so one
+# client can't read another's history. In-memory and per process; the least
+# recently used threads are evicted.
+MAX_THREADS = 1000
+_threads: "OrderedDict[str, List[Dict[str, str]]]" = OrderedDict()
+_threads_lock = threading.Lock()
+
+
+def _remember_turn(thread_id: Optional[str], result: dict, reply: str):
+    """Store the thread's history including this turn's assistant reply."""
+    if not thread_id:
+        return
+    history = list(result.get("conversation") or [])
+    history.append({"role": "assistant", "content": reply})
+    with _threads_lock:
+        _threads[thread_id] = history
+        _threads.move_to_end(thread_id)
+        while len(_threads) > MAX_THREADS:
+            _threads.popitem(last=False)
+
+
+_FLIGHT_RESULTS = TypeAdapter(List[FlightResult])
+
+
+def _leg_payload(leg: dict) -> dict:
+    """Plain-dict form of one formatted flight leg for FlightResult validation."""
+    stops = leg.get("stops")
+    return {
+        "airline": str(leg.get("airline", "N/A")),
+        "flight_number": str(leg.get("flight_number", "N/A")),
+        "departure_airport": str(leg.get("departure_airport", "N/A")),
+        "arrival_airport": str(leg.get("arrival_airport", "N/A")),
+        "departure_time": str(leg.get("departure_time", "N/A")),
+        "arrival_time": str(leg.get("arrival_time", "N/A")),
+        "duration": str(leg.get("duration", "N/A")),
+        "stops": int(stops) if stops is not None else None,
+        "layovers": list(leg.get("layovers") or []),
+    }
+
 
 @app.get("/")
 async def root():
@@ -51,153 +100,158 @@ async def health():
     return {"status": "healthy", "message": "All API keys configured"}
 
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest):
-    """
-    Handles the conversation for flight search.
-    """
-    try:
-        # Ensure message is present
-        user_message = (request.message or "").strip()
-        if not user_message:
-            raise HTTPException(status_code=400, detail="Message cannot be empty")
-
-        # Always use a list for history
-        conversation_history = request.conversation_history or []
-        if not isinstance(conversation_history, list):
-            conversation_history = []
-
-        # Validate API keys
-        required_keys = ["OPENAI_API_KEY", "AMADEUS_CLIENT_ID", "AMADEUS_CLIENT_SECRET"]
-        missing_keys = [key for key in required_keys if not os.getenv(key)]
-        if missing_keys:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Missing API keys: {', '.join(missing_keys)}"
-            )
+def _prepare_state(request: ChatRequest) -> Tuple[dict, str]:
+    """Validate a chat request and build the initial graph state and thread id for it."""
+    # Ensure message is present
+    user_message = (request.message or "").strip()
+    if not user_message:
+        raise HTTPException(status_code=400, detail="Message cannot be empty")
 
-        # Initialize conversation state safely (default round trip)
-        state = initialize_state_from_request(user_message, conversation_history)
-        state.setdefault("conversation", conversation_history)
-        state.setdefault("current_message", user_message)
+    # Always use a list for history
+    conversation_history = request.conversation_history or []
+    if not isinstance(conversation_history, list):
+        conversation_history = []
+    thread_id = request.thread_id
+    if thread_id:
+        # Only ids this server issued (and hasn't evicted or reset) are accepted
+        with _threads_lock:
+            stored_history = _threads.get(thread_id)
+        if stored_history is None:
+            raise HTTPException(status_code=404, detail="Unknown or expired thread_id")
+        if not conversation_history:
+            conversation_history = list(stored_history)
+    else:
+        thread_id = uuid.uuid4().hex
 
-        # Run LangGraph
-        try:
-            result = graph.invoke(state)
-        except GraphRecursionError:
-            raise HTTPException(
-                status_code=500,
-                detail="Conversation loop limit reached — possible infinite loop in workflow"
-            )
-
-        # Build extracted info
-        extracted_info = ExtractedInfo(
-            departure_date=result.get("departure_date"),
-            origin=result.get("origin"),
-            destination=result.get("destination"),
-            cabin_class=result.get("cabin_class"),
-            trip_type=result.get("trip_type"),
-            duration=result.get("duration")
+    # Validate API keys
+    required_keys = ["OPENAI_API_KEY", "AMADEUS_CLIENT_ID", "AMADEUS_CLIENT_SECRET"]
+    missing_keys = [key for key in required_keys if not os.getenv(key)]
+    if missing_keys:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Missing API keys: {', '.join(missing_keys)}"
         )
 
-        # Still collecting info
-        if result.get("needs_followup", True):
-            # Check if we're waiting for flight selection
-            if result.get("waiting_for_selection", False):
-                # Format detailed flight offers for display
-                detailed_offers = []
-                all_offers = result.get("all_offers", [])
-                
-                for offer_data in all_offers:
-                    details = offer_data.get("display_details", {})
-                    detailed_offer = DetailedOffer(
-                        offer_id=details.get("offer_id"),
-                        day_type=offer_data.get("day_type", "unknown"),
-                        price=details.get("price"),
-                        search_date=details.get("search_date"),
-                        outbound_details=details.get("outbound_details", {}),
-                        return_details=details.get("return_details")
-                    )
-                    detailed_offers.append(detailed_offer)
-                
-                return ChatResponse(
-                    response_type="selection",
-                    message=result.get("followup_question", "Please select a flight offer to proceed."),
-                    extracted_info=extracted_info,
-                    debug_trace=result.get("node_trace"),
-                    all_offers=detailed_offers,
-                    waiting_for_selection=True
-                )
-            else:
-                return ChatResponse(
-                    response_type="question",
-                    message=result.get("followup_question", "Could you provide more details about your flight?"),
-                    extracted_info=extracted_info,
-                    debug_trace=result.get("node_trace")
-                )
+    # Initialize conversation state safely (default round trip)
+    state = initialize_state_from_request(user_message, conversation_history)
+    state.setdefault("conversation", conversation_history)
+    state.setdefault("current_message", user_message)
+    return state, thread_id
 
-        # Build flight results
-        flights = [
-            FlightResult(
-                price=str(f.get("price", "N/A")),
-                currency=str(f.get("currency", "USD")),
-                search_date=str(f.get("search_date", "")) or None,
-                outbound={
-                    "airline": str(f.get("outbound", {}).get("airline", "N/A")),
-                    "flight_number": str(f.get("outbound", {}).get("flight_number", "N/A")),
-                    "departure_airport": str(f.get("outbound", {}).get("departure_airport", "N/A")),
-                    "arrival_airport": str(f.get("outbound", {}).get("arrival_airport", "N/A")),
-                    "departure_time": str(f.get("outbound", {}).get("departure_time", "N/A")),
-                    "arrival_time": str(f.get("outbound", {}).get("arrival_time", "N/A")),
-                    "duration": str(f.get("outbound", {}).get("duration", "N/A")),
-                    "stops": int(f.get("outbound", {}).get("stops", 0)) if f.get("outbound", {}).get("stops") is not None else None,
-                    "layovers": [str(x) for x in (f.get("outbound", {}).get("layovers") or [])],
-                },
-                return_leg={
-                    "airline": str(f.get("return_leg", {}).get("airline", "N/A")),
-                    "flight_number": str(f.get("return_leg", {}).get("flight_number", "N/A")),
-                    "departure_airport": str(f.get("return_leg", {}).get("departure_airport", "N/A")),
-                    "arrival_airport": str(f.get("return_leg", {}).get("arrival_airport", "N/A")),
-                    "departure_time": str(f.get("return_leg", {}).get("departure_time", "N/A")),
-                    "arrival_time": str(f.get("return_leg", {}).get("arrival_time", "N/A")),
-                    "duration": str(f.get("return_leg", {}).get("duration", "N/A")),
-                    "stops": int(f.get("return_leg", {}).get("stops", 0)) if f.get("return_leg", {}).get("stops") is not None else None,
-                    "layovers": [str(x) for x in (f.get("return_leg", {}).get("layovers") or [])],
-                } if f.get("return_leg") else None,
-            )
-            for f in result.get("formatted_results", [])
-        ]
-
-        # Check if user has selected a flight offer
-        if result.get("selected_flight_offer_id"):
-            # Get the selected flight offer details
-            selected_offer = result.get("selected_flight_offer", {})
-            selected_offer_id = result.get("selected_flight_offer_id")
+
+def _build_chat_response(result: dict) -> ChatResponse:
+    """Turn the final graph state into the API response."""
+    # Build extracted info
+    extracted_info = ExtractedInfo(
+        departure_date=result.get("departure_date"),
+        origin=result.get("origin"),
+        destination=result.get("destination"),
+        cabin_class=result.get("cabin_class"),
+        trip_type=result.get("trip_type"),
+        duration=result.get("duration")
+    )
+
+    # Still collecting info
+    if result.get("needs_followup", True):
+        # Check if we're waiting for flight selection
+        if result.get("waiting_for_selection", False):
+            # Format detailed flight offers for display
+            detailed_offers = []
+            all_offers = result.get("all_offers", [])
             
-            # Create a detailed confirmation response
-            confirmation_message = result.get("final_confirmation", "Your flight has been selected successfully!")
+            for offer_data in all_offers:
+                details = offer_data.get("display_details", {})
+                detailed_offer = DetailedOffer(
+                    offer_id=details.get("offer_id"),
+                    day_type=offer_data.get("day_type", "unknown"),
+                    price=details.get("price"),
+                    search_date=details.get("search_date"),
+                    outbound_details=details.get("outbound_details", {}),
+                    return_details=details.get("return_details")
+                )
+                detailed_offers.append(detailed_offer)
             
             return ChatResponse(
-                response_type="confirmation",
-                message=confirmation_message,
+                response_type="selection",
+                message=result.get("followup_question", "Please select a flight offer to proceed."),
                 extracted_info=extracted_info,
-                flights=flights,
-                summary=result.get("summary"),
                 debug_trace=result.get("node_trace"),
-                # Include selected flight details
-                selected_flight_offer_id=selected_offer_id,
-                selected_flight_offer=selected_offer
+                all_offers=detailed_offers,
+                waiting_for_selection=True
             )
         else:
             return ChatResponse(
-                response_type="results",
-                message="Here are your flight options:",
+                response_type="question",
+                message=result.get("followup_question", "Could you provide more details about your flight?"),
                 extracted_info=extracted_info,
-                flights=flights,
-                summary=result.get("summary"),
                 debug_trace=result.get("node_trace")
             )
 
+    # Build flight results, validated in one pass
+    flights = _FLIGHT_RESULTS.validate_python([
+        {
+            "price": str(f.get("price", "N/A")),
+            "currency": str(f.get("currency", "USD")),
+            "search_date": str(f.get("search_date", "")) or None,
+            "outbound": _leg_payload(f.get("outbound") or {}),
+            "return_leg": _leg_payload(f["return_leg"]) if f.get("return_leg") else None,
+        }
+        for f in result.get("formatted_results", [])
+    ])
+
+    # Check if user has selected a flight offer
+    if result.get("selected_flight_offer_id"):
+        # Get the selected flight offer details
+        selected_offer = result.get("selected_flight_offer", {})
+        selected_offer_id = result.get("selected_flight_offer_id")
+
+        # Create a detailed confirmation response
+        confirmation_message = result.get("final_confirmation", "Your flight has been selected successfully!")
+
+        return ChatResponse(
+            response_type="confirmation",
+            message=confirmation_message,
+            extracted_info=extracted_info,
+            flights=flights,
+            summary=result.get("summary"),
+            debug_trace=result.get("node_trace"),
+            # Include selected flight details
+            selected_flight_offer_id=selected_offer_id,
+            selected_flight_offer=selected_offer
+        )
+    else:
+        return ChatResponse(
+            response_type="results",
+            message="Here are your flight options:",
+            extracted_info=extracted_info,
+            flights=flights,
+            summary=result.get("summary"),
+            debug_trace=result.get("node_trace")
+        )
+
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat_endpoint(request: ChatRequest):
+    """
+    Handles the conversation for flight search.
+    """
+    try:
+        state, thread_id = _prepare_state(request)
+
+        # Run LangGraph
+        try:
+            result = graph.invoke(state)
+        except GraphRecursionError:
+            raise HTTPException(
+                status_code=500,
+                detail="Conversation loop limit reached — possible infinite loop in workflow"
+            )
+
+        response = _build_chat_response(result)
+        response.thread_id = thread_id
+        _remember_turn(thread_id, result, response.message)
+        return response
+
     except HTTPException:
         raise
     except Exception as e:
@@ -208,8 +262,53 @@ async def chat_endpoint(request: ChatRequest):
         )
 
 
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    """
+    Same conversation as /chat, delivered as Server-Sent Events.
+
+    "token" events carry summary text as the LLM produces it; the stream ends
+    with a single "result" event holding the ChatResponse, or an "error" event.
+    """
+    state, thread_id = _prepare_state(request)
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+
+    def emit(event: str, data: str):
+        loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+    def run_graph():
+        try:
+            result = graph.invoke(state, config={
+                "configurable": {"on_token": lambda token: emit("token", orjson.dumps(token).decode())}
+            })
+            response = _build_chat_response(result)
+            response.thread_id = thread_id
+            _remember_turn(thread_id, result, response.message)
+            emit("result", response.model_dump_json())
+        except GraphRecursionError:
+            emit("error", orjson.dumps({"detail": "Conversation loop limit reached — possible infinite loop in workflow"}).decode())
+        except Exception as e:
+            print(f"Error in chat stream endpoint: {e}")
+            emit("error", orjson.dumps({"detail": "Internal server error while processing request"}).decode())
+
+    async def event_stream():
+        worker = loop.run_in_executor(None, run_graph)
+        while True:
+            event, data = await events.get()
+            yield f"event: {event}\ndata: {data}\n\n"
+            if event != "token":
+                break
+        await worker
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 @app.post("/reset")
-async def reset_conversation():
+async def reset_conversation(thread_id: Optional[str] = None):
+    if thread_id:
+        with _threads_lock:
+            _threads.pop(thread_id, None)
     return {"message": "Conversation reset. You can start a new flight search."}
 
 
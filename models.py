@@ -1,5 +1,5 @@
 from typing import TypedDict, Optional, List, Dict, Any
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 # LangGraph State
 class FlightSearchState(TypedDict):
@@ -52,8 +52,12 @@ class Message(BaseModel):
     content: str
 
 class ChatRequest(BaseModel):
-    message: str
+    message: str = Field(max_length=2000)
     conversation_history: List[Message] = []
+    # Id from a previous response's thread_id; when conversation_history is
+    # empty the server supplies the history it stored for this thread. Ids the
+    # server did not issue are rejected.
+    thread_id: Optional[str] = None
 
 class ExtractedInfo(BaseModel):
     departure_date: Optional[str] = None
@@ -102,4 +106,6 @@ class ChatResponse(BaseModel):
     waiting_for_selection: Optional[bool] = None
     # Selected flight offer details
     selected_flight_offer_id: Optional[str] = None
-    selected_flight_offer: Optional[Dict[str, Any]] = None
\ No newline at end of file
+    selected_flight_offer: Optional[Dict[str, Any]] = None
+    # Server-issued id to send back as ChatRequest.thread_id on the next turn
+    thread_id: Optional[str] = None
\ No newline at end of file
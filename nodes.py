@@ -1,14 +1,18 @@
-import json
+import copy
+import orjson
 import requests
 import os
 import re
 from datetime import datetime, timedelta
-from typing import Dict, Any, List
+from functools import lru_cache
+from typing import Dict, Any, List, Optional
 from langchain_openai import ChatOpenAI
 from langchain.schema import HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from models import FlightSearchState
+from validators import validate_cabin_class, validate_duration
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -19,7 +23,7 @@ def _debug_print(label: str, payload: Any = None):
     if DEBUG:
         try:
             if isinstance(payload, (dict, list)):
-                print(f"[DEBUG] {label}:\n" + json.dumps(payload, indent=2, ensure_ascii=False))
+                print(f"[DEBUG] {label}:\n" + orjson.dumps(payload, option=orjson.OPT_INDENT_2).decode())
             else:
                 print(f"[DEBUG] {label}: {payload}")
         except Exception:
@@ -42,6 +46,130 @@ def get_llm() -> ChatOpenAI:
     return _llm
 
 
+# Fields that must be collected before a flight search can run
+REQUIRED_FIELDS = ("departure_date", "origin", "destination", "cabin_class", "duration")
+
+# Deterministic follow-up per missing field, asked in order of importance
+_FOLLOWUP_QUESTIONS = {
+    "departure_date": "What date would you like to depart?",
+    "duration": "How many days will you stay before flying back?",
+    "origin": "Which city are you flying from?",
+    "destination": "Which city are you flying to?",
+    "cabin_class": "Which cabin class would you prefer: economy, business, or first class?",
+}
+_FOLLOWUP_PRIORITY = ("departure_date", "duration", "origin", "destination", "cabin_class")
+
+# City names are one to four space-separated words; keeping the words free of spaces
+# and the count bounded stops the two groups from backtracking against each other.
+_ROUTE_RE = re.compile(
+    r"\bfrom\s+([a-z][a-z.'-]*(?: [a-z][a-z.'-]*){0,3}?)\s+to\s+([a-z][a-z.'-]*(?: [a-z][a-z.'-]*){0,3}?)"
+    r"\s*(?=$|[,.;!?\d]|\b(?:on|in|for|at|and)\b)",
+    re.IGNORECASE,
+)
+# Longer messages go straight to the LLM; they are rarely pattern-only anyway
+_RULE_BASED_MAX_CHARS = 200
+_ISO_DATE_RE = re.compile(r"\b\d{4}-\d{2}-\d{2}\b", re.ASCII)
+_DURATION_RE = re.compile(r"(?<!\bin\s)\b(\d{1,3})\s*(?:days?|nights?)\b", re.IGNORECASE | re.ASCII)
+# "business" and "first" only count with "class" ("business trip" is not a cabin)
+_CABIN_RE = re.compile(r"\b(?:(economy|eco|coach|biz)(?:\s+class)?|(business|first)\s+class)\b", re.IGNORECASE)
+_WORD_RE = re.compile(r"[\w']+")
+
+# Words that may surround the recognized patterns without carrying flight details
+_FILLER_WORDS = frozenset({
+    "a", "an", "the", "i", "i'm", "im", "we", "me", "my", "us", "to", "on", "for", "in", "at", "and",
+    "want", "would", "like", "need", "please", "fly", "flying", "go", "going", "travel", "book",
+    "flight", "flights", "ticket", "tickets", "trip", "round", "return", "class", "cabin",
+    "stay", "staying", "depart", "departing", "leaving", "hi", "hello", "hey", "thanks",
+})
+# Words that never belong in a city name; a route capturing them misread the message
+_NON_PLACE_WORDS = _FILLER_WORDS | frozenset({
+    "next", "this", "week", "weekend", "month", "today", "tonight", "tomorrow", "day", "days",
+    "economy", "eco", "coach", "business", "biz", "first", "premium", "actually", "instead",
+})
+
+
+def _parse_message_rule_based(text: str) -> Optional[Dict[str, Any]]:
+    """Fields from one user message if the patterns account for all of it, else None."""
+    if len(text) > _RULE_BASED_MAX_CHARS:
+        return None
+    routes = list(_ROUTE_RE.finditer(text))
+    dates = list(_ISO_DATE_RE.finditer(text))
+    durations = list(_DURATION_RE.finditer(text))
+    cabins = list(_CABIN_RE.finditer(text))
+    matches = routes + dates + durations + cabins
+    # Nothing recognized, or the same detail given twice ("..., actually make it ...")
+    if not matches or any(len(group) > 1 for group in (routes, dates, durations, cabins)):
+        return None
+
+    # Anything left besides filler is information only the LLM can interpret
+    rest = text
+    for match in sorted(matches, key=lambda m: m.start(), reverse=True):
+        rest = rest[:match.start()] + " " + rest[match.end():]
+    if any(word not in _FILLER_WORDS for word in _WORD_RE.findall(rest.lower())):
+        return None
+
+    found: Dict[str, Any] = {}
+    if routes:
+        origin, destination = (routes[0].group(i).strip(" .'-") for i in (1, 2))
+        if any(word in _NON_PLACE_WORDS for word in (origin + " " + destination).lower().split()):
+            return None
+        found["origin"] = origin.title()
+        found["destination"] = destination.title()
+
+    if dates:
+        # Explicit dates are taken as written: no year roll-forward, past dates go to the LLM
+        try:
+            departure = datetime.strptime(dates[0].group(0), "%Y-%m-%d").date()
+        except ValueError:
+            return None
+        today = datetime.now().date()
+        if not today <= departure <= today + timedelta(days=730):
+            return None
+        found["departure_date"] = departure.strftime("%Y-%m-%d")
+
+    if durations:
+        duration = validate_duration(durations[0].group(1))
+        if not duration:
+            return None
+        found["duration"] = duration
+
+    if cabins:
+        cabin = validate_cabin_class(cabins[0].group(1) or cabins[0].group(2))
+        if not cabin:
+            return None
+        found["cabin_class"] = cabin
+    return found
+
+
+def _extract_info_rule_based(conversation: List[Dict[str, str]]):
+    """Extract unambiguous flight details from the user's messages without the LLM.
+
+    Only explicit patterns are recognized ("from X to Y", ISO dates, "N days",
+    cabin keywords); later messages override earlier ones. Returns the extracted
+    fields and whether every user message was fully accounted for by them —
+    if not, some message holds information only the LLM can interpret.
+    """
+    extracted: Dict[str, Any] = {}
+    all_parsed = True
+    for message in conversation:
+        if message.get("role") != "user":
+            continue
+        found = _parse_message_rule_based(message.get("content") or "")
+        if found is None:
+            all_parsed = False
+        else:
+            extracted.update(found)
+    return extracted, all_parsed
+
+
+def _compose_followup(missing_fields) -> str:
+    """Ask for the most important missing field without calling the LLM."""
+    for field in _FOLLOWUP_PRIORITY:
+        if field in missing_fields:
+            return _FOLLOWUP_QUESTIONS[field]
+    return "I still need some information to search for flights. Could you help me with the missing details?"
+
+
 def llm_conversation_node(state: FlightSearchState) -> FlightSearchState:
     """LLM-driven conversational node that intelligently handles all user input parsing and follow-up questions."""
     try:
@@ -59,6 +187,20 @@ def llm_conversation_node(state: FlightSearchState) -> FlightSearchState:
     current_day = current_date.day
     current_year = current_date.year
 
+    # Cheap rule-based pass first: if it already covers every required field
+    # there is nothing left for the LLM to extract or ask about.
+    # Partial results stay out of the state so they can't bias the LLM's reading.
+    extracted, all_parsed = _extract_info_rule_based(state.get("conversation", []))
+    heuristic_missing = [f for f in REQUIRED_FIELDS if not (extracted.get(f) or state.get(f))]
+    if all_parsed and not heuristic_missing:
+        state.update(extracted)
+        _debug_print("Rule-based extraction complete, skipping LLM", extracted)
+        state["followup_question"] = None
+        state["needs_followup"] = False
+        state["info_complete"] = True
+        state["current_node"] = "llm_conversation"
+        return state
+
     try:
         if not os.getenv("OPENAI_API_KEY"):
             # Fallback if no LLM available
@@ -128,11 +270,15 @@ EXAMPLES:
 
 BE SMART: If user provides multiple pieces of info at once, extract all of them. Ask natural, conversational questions."""
 
-        response = get_llm().invoke([HumanMessage(content=llm_prompt)])
+        # One call both extracts the fields and phrases the follow-up; JSON mode
+        # keeps the reply parseable (no prose or code fences around the object).
+        response = get_llm().bind(response_format={"type": "json_object"}).invoke(
+            [HumanMessage(content=llm_prompt)]
+        )
         
         try:
             # Parse LLM response
-            llm_result = json.loads(response.content)
+            llm_result = orjson.loads(response.content)
             
             # Update state with extracted information
             if llm_result.get("departure_date"):
@@ -153,10 +299,10 @@ BE SMART: If user provides multiple pieces of info at once, extract all of them.
             
             _debug_print("LLM extraction result", llm_result)
             
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             # Fallback if LLM doesn't return valid JSON
             print(f"LLM response parsing error. Raw response: {response.content}")
-            state["followup_question"] = "I had trouble understanding. Could you please tell me your departure city, destination, and preferred travel date?"
+            state["followup_question"] = _compose_followup(set(heuristic_missing))
             state["needs_followup"] = True
             state["info_complete"] = False
 
@@ -179,10 +325,9 @@ def analyze_conversation_node(state: FlightSearchState) -> FlightSearchState:
         pass
 
     # Check completeness - all required fields must be present
-    required_fields = ["departure_date", "origin", "destination", "cabin_class", "duration"]
     missing_fields = []
     
-    for field in required_fields:
+    for field in REQUIRED_FIELDS:
         if not state.get(field):
             missing_fields.append(field)
     
@@ -205,7 +350,7 @@ def analyze_conversation_node(state: FlightSearchState) -> FlightSearchState:
         state["needs_followup"] = True
         # The LLM should have already set an appropriate followup question
         if not state.get("followup_question"):
-            state["followup_question"] = "I still need some information to search for flights. Could you help me with the missing details?"
+            state["followup_question"] = _compose_followup(set(missing_fields))
     else:
         state["info_complete"] = True
         state["needs_followup"] = False
@@ -214,32 +359,25 @@ def analyze_conversation_node(state: FlightSearchState) -> FlightSearchState:
     _debug_print("Info completeness check", {
         "missing_fields": missing_fields,
         "info_complete": state["info_complete"],
-        "current_state": {k: state.get(k) for k in required_fields}
+        "current_state": {k: state.get(k) for k in REQUIRED_FIELDS}
     })
     
     state["current_node"] = "analyze_conversation"
     return state
 
 
-def normalize_info_node(state: FlightSearchState) -> FlightSearchState:
-    """Normalize extracted information for Amadeus API format using LLM for intelligent mapping."""
-    try:
-        (state.setdefault("node_trace", [])).append("normalize_info")
-    except Exception:
-        pass
-    
-    def normalize_location_to_airport_code(location: str) -> str:
-        """Convert city name to airport code using LLM for intelligent mapping."""
-        if not location:
-            return ""
-            
-        # If already looks like airport code (3 letters), return as is
-        if len(location.strip()) == 3 and location.isalpha():
-            return location.upper()
-        
-        try:
-            if os.getenv("OPENAI_API_KEY"):
-                airport_prompt = f"""Convert this city or location to its primary IATA airport code: "{location}"
+class _AirportCodeNotFound(Exception):
+    """The LLM's reply held no IATA code; raised so the miss is not cached."""
+
+
+@lru_cache(maxsize=64)
+def _lookup_airport_code(location_key: str) -> str:
+    """Ask the LLM for the primary IATA code of a location.
+
+    Cached per normalized location so repeat searches skip the API call;
+    errors, including a reply without a code, raise and are therefore not cached.
+    """
+    airport_prompt = f"""Convert this city or location to its primary IATA airport code: "{location_key}"
 
 Rules:
 - Return ONLY the 3-letter IATA airport code
@@ -247,59 +385,88 @@ Rules:
 - Examples: "New York" → "JFK", "Los Angeles" → "LAX", "London" → "LHR", "Paris" → "CDG"
 
 Airport code:"""
-                
-                airport_response = get_llm().invoke([HumanMessage(content=airport_prompt)])
-                airport_code = airport_response.content.strip().upper()
-                
-                # Extract 3-letter code from response
-                codes = re.findall(r'\b[A-Z]{3}\b', airport_code)
-                if codes:
-                    return codes[0]
-                elif len(airport_code) == 3 and airport_code.isalpha():
-                    return airport_code
-        except Exception as e:
-            print(f"Error getting airport code for {location}: {e}")
-        
-        # Fallback mappings for common cities
-        airport_mappings = {
-            'new york': 'JFK', 'nyc': 'JFK', 'new york city': 'JFK',
-            'los angeles': 'LAX', 'la': 'LAX', 'los angeles california': 'LAX',
-            'chicago': 'ORD', 'london': 'LHR', 'paris': 'CDG',
-            'tokyo': 'NRT', 'dubai': 'DXB', 'amsterdam': 'AMS',
-            'frankfurt': 'FRA', 'madrid': 'MAD', 'rome': 'FCO',
-            'barcelona': 'BCN', 'milan': 'MXP', 'zurich': 'ZUR',
-        }
-        
-        location_lower = location.lower().strip()
-        if location_lower in airport_mappings:
-            return airport_mappings[location_lower]
+
+    airport_response = get_llm().invoke([HumanMessage(content=airport_prompt)])
+    airport_code = airport_response.content.strip().upper()
+
+    # Extract 3-letter code from response
+    codes = re.findall(r'\b[A-Z]{3}\b', airport_code)
+    if codes:
+        return codes[0]
+    elif len(airport_code) == 3 and airport_code.isalpha():
+        return airport_code
+    raise _AirportCodeNotFound(airport_code)
+
+
+# Fallback city -> IATA codes for when the LLM lookup is unavailable
+_AIRPORT_CODES = {
+    'new york': 'JFK', 'nyc': 'JFK', 'new york city': 'JFK',
+    'los angeles': 'LAX', 'la': 'LAX', 'los angeles california': 'LAX',
+    'chicago': 'ORD', 'london': 'LHR', 'paris': 'CDG',
+    'tokyo': 'NRT', 'dubai': 'DXB', 'amsterdam': 'AMS',
+    'frankfurt': 'FRA', 'madrid': 'MAD', 'rome': 'FCO',
+    'barcelona': 'BCN', 'milan': 'MXP', 'zurich': 'ZUR',
+}
+
+
+def _normalize_location_to_airport_code(location: str) -> str:
+    """Convert city name to airport code using LLM for intelligent mapping."""
+    if not location:
+        return ""
         
-        # Final fallback: first 3 letters
-        return location[:3].upper()
+    # If already looks like airport code (3 letters), return as is
+    if len(location.strip()) == 3 and location.isalpha():
+        return location.upper()
     
-    def normalize_cabin_class(cabin: str) -> str:
-        """Normalize cabin class to Amadeus format"""
-        if not cabin:
-            return 'ECONOMY'
-            
-        cabin_lower = cabin.lower()
-        if 'economy' in cabin_lower or 'eco' in cabin_lower or 'coach' in cabin_lower:
-            return 'ECONOMY'
-        elif 'business' in cabin_lower or 'biz' in cabin_lower:
-            return 'BUSINESS'
-        elif 'first' in cabin_lower:
-            return 'FIRST_CLASS'
-        else:
-            return 'ECONOMY'  # Default
+    try:
+        if os.getenv("OPENAI_API_KEY"):
+            return _lookup_airport_code(location.lower().strip())
+    except _AirportCodeNotFound as e:
+        _debug_print(f"No airport code from LLM for {location}", str(e))
+    except Exception as e:
+        print(f"Error getting airport code for {location}: {e}")
+    
+    # Fallback mappings for common cities
+    location_lower = location.lower().strip()
+    if location_lower in _AIRPORT_CODES:
+        return _AIRPORT_CODES[location_lower]
+    
+    # Final fallback: first 3 letters
+    return location[:3].upper()
+
+
+@lru_cache(maxsize=64)
+def _normalize_cabin_class(cabin: str) -> str:
+    """Normalize cabin class to Amadeus format"""
+    if not cabin:
+        return 'ECONOMY'
+        
+    cabin_lower = cabin.lower()
+    if 'economy' in cabin_lower or 'eco' in cabin_lower or 'coach' in cabin_lower:
+        return 'ECONOMY'
+    elif 'business' in cabin_lower or 'biz' in cabin_lower:
+        return 'BUSINESS'
+    elif 'first' in cabin_lower:
+        return 'FIRST_CLASS'
+    else:
+        return 'ECONOMY'  # Default
+
+
+def normalize_info_node(state: FlightSearchState) -> FlightSearchState:
+    """Normalize extracted information for Amadeus API format using LLM for intelligent mapping."""
+    try:
+        (state.setdefault("node_trace", [])).append("normalize_info")
+    except Exception:
+        pass
     
     try:
         # Normalize airport codes
         if state.get('origin'):
-            state['origin_location_code'] = normalize_location_to_airport_code(state['origin'])
+            state['origin_location_code'] = _normalize_location_to_airport_code(state['origin'])
             _debug_print(f"Origin normalization", f"{state['origin']} → {state['origin_location_code']}")
         
         if state.get('destination'):
-            state['destination_location_code'] = normalize_location_to_airport_code(state['destination'])
+            state['destination_location_code'] = _normalize_location_to_airport_code(state['destination'])
             _debug_print(f"Destination normalization", f"{state['destination']} → {state['destination_location_code']}")
         
         # Normalize other fields
@@ -307,7 +474,7 @@ Airport code:"""
             state['normalized_departure_date'] = state['departure_date']
         
         if state.get('cabin_class'):
-            state['normalized_cabin'] = normalize_cabin_class(state['cabin_class'])
+            state['normalized_cabin'] = _normalize_cabin_class(state['cabin_class'])
             
         # Always round trip
         state['normalized_trip_type'] = 'round_trip'
@@ -322,6 +489,65 @@ Airport code:"""
     return state
 
 
+def _format_flight_offers_body(
+    origin_location_code,
+    destination_location_code,
+    departure_date,
+    cabin="ECONOMY",
+    duration=None
+):
+    """Build the Amadeus flight-offers search body, adding the return leg when duration is set."""
+    origin_destinations = [
+        {
+            "id": "1",
+            "originLocationCode": origin_location_code,
+            "destinationLocationCode": destination_location_code,
+            "departureDateTimeRange": {
+                "date": departure_date,
+                "time": "10:00:00"
+            }
+        }
+    ]
+
+    # Always add return leg for round trip
+    if duration is not None:
+        dep_date = datetime.strptime(departure_date, "%Y-%m-%d")
+        return_date = (dep_date + timedelta(days=int(duration))).strftime("%Y-%m-%d")
+        origin_destinations.append({
+            "id": "2",
+            "originLocationCode": destination_location_code,
+            "destinationLocationCode": origin_location_code,
+            "departureDateTimeRange": {
+                "date": return_date,
+                "time": "10:00:00"
+            }
+        })
+
+    return {
+        "currencyCode": "EGP",
+        "originDestinations": origin_destinations,
+        "travelers": [
+            {
+                "id": "1",
+                "travelerType": "ADULT"
+            }
+        ],
+        "sources": ["GDS"],
+        "searchCriteria": {
+            "maxFlightOffers": 5,
+            "flightFilters": {
+                "cabinRestrictions": [
+                    {
+                        "cabin": cabin,
+                        "coverage": "MOST_SEGMENTS",
+                        "originDestinationIds": [od["id"] for od in origin_destinations]
+                    }
+                ]
+            }
+        }
+    }
+
+
 def format_body_node(state: FlightSearchState) -> FlightSearchState:
     """Format the request body for Amadeus API"""
     try:
@@ -329,65 +555,8 @@ def format_body_node(state: FlightSearchState) -> FlightSearchState:
     except Exception:
         pass
     
-    def format_flight_offers_body(
-        origin_location_code,
-        destination_location_code,
-        departure_date,
-        cabin="ECONOMY",
-        duration=None
-    ):
-        origin_destinations = [
-            {
-                "id": "1",
-                "originLocationCode": origin_location_code,
-                "destinationLocationCode": destination_location_code,
-                "departureDateTimeRange": {
-                    "date": departure_date,
-                    "time": "10:00:00"
-                }
-            }
-        ]
-        
-        # Always add return leg for round trip
-        if duration is not None:
-            dep_date = datetime.strptime(departure_date, "%Y-%m-%d")
-            return_date = (dep_date + timedelta(days=int(duration))).strftime("%Y-%m-%d")
-            origin_destinations.append({
-                "id": "2",
-                "originLocationCode": destination_location_code,
-                "destinationLocationCode": origin_location_code,
-                "departureDateTimeRange": {
-                    "date": return_date,
-                    "time": "10:00:00"
-                }
-            })
-        
-        return {
-            "currencyCode": "EGP",
-            "originDestinations": origin_destinations,
-            "travelers": [
-                {
-                    "id": "1",
-                    "travelerType": "ADULT"
-                }
-            ],
-            "sources": ["GDS"],
-            "searchCriteria": {
-                "maxFlightOffers": 5,
-                "flightFilters": {
-                    "cabinRestrictions": [
-                        {
-                            "cabin": cabin,
-                            "coverage": "MOST_SEGMENTS",
-                            "originDestinationIds": [od["id"] for od in origin_destinations]
-                        }
-                    ]
-                }
-            }
-        }
-    
     # Create the API request body
-    state["body"] = format_flight_offers_body(
+    state["body"] = _format_flight_offers_body(
         origin_location_code=state.get("origin_location_code"),
         destination_location_code=state.get("destination_location_code"),
         departure_date=state.get("normalized_departure_date"),
@@ -421,7 +590,7 @@ def get_access_token_node(state: FlightSearchState) -> FlightSearchState:
     try:
         response = requests.post(url, headers=headers, data=data, timeout=10)
         response.raise_for_status()
-        token_json = response.json()
+        token_json = orjson.loads(response.content)
         state["access_token"] = token_json.get("access_token")
         state["current_node"] = "get_auth"
         if DEBUG:
@@ -467,7 +636,8 @@ def get_flight_offers_node(state: FlightSearchState) -> FlightSearchState:
     bodies = []
     for day_offset in range(0, 5):
         query_date = (start_date + timedelta(days=day_offset)).strftime("%Y-%m-%d")
-        body = dict(state["body"]) if state.get("body") else {}
+        # Deep copy: each day rewrites the nested originDestinations dates
+        body = copy.deepcopy(state["body"]) if state.get("body") else {}
         
         if body.get("originDestinations"):
             # Update departure date
@@ -487,9 +657,9 @@ def get_flight_offers_node(state: FlightSearchState) -> FlightSearchState:
     def fetch_for_day(day_body_tuple):
         day, body = day_body_tuple
         try:
-            resp = requests.post(base_url, headers=headers, json=body, timeout=12)
+            resp = requests.post(base_url, headers=headers, data=orjson.dumps(body), timeout=12)
             resp.raise_for_status()
-            data = resp.json()
+            data = orjson.loads(resp.content)
             flights = data.get("data", []) or []
             for f in flights[:5]:
                 f["_search_date"] = day
@@ -511,6 +681,67 @@ def get_flight_offers_node(state: FlightSearchState) -> FlightSearchState:
     return state
 
 
+_ISO_DURATION_RE = re.compile(r"PT(?:(\d+)H)?(?:(\d+)M)?")
+
+
+def _format_duration(duration_str):
+    """Turn an ISO-8601 duration like PT8H15M into "8h 15m"."""
+    if not duration_str or not duration_str.startswith('PT'):
+        return duration_str
+    match = _ISO_DURATION_RE.match(duration_str)
+    hours = int(match.group(1) or 0)
+    minutes = int(match.group(2) or 0)
+    if hours > 0 and minutes > 0:
+        return f"{hours}h {minutes}m"
+    elif hours > 0:
+        return f"{hours}h"
+    elif minutes > 0:
+        return f"{minutes}m"
+    else:
+        return "N/A"
+
+
+def _format_time(datetime_str):
+    """Turn an ISO-8601 timestamp into HH:MM."""
+    if not datetime_str:
+        return "N/A"
+    try:
+        dt = datetime.fromisoformat(datetime_str.replace('Z', '+00:00'))
+        return dt.strftime('%H:%M')
+    except:
+        return datetime_str
+
+
+def _build_leg(itinerary) -> Dict[str, Any]:
+    """Summarize one Amadeus itinerary as a display leg with stops and layovers."""
+    segments = itinerary.get("segments", [])
+    if not segments:
+        return None
+
+    layovers = []
+    for current, following in zip(segments, segments[1:]):
+        arr = current.get("arrival", {})
+        dep = following.get("departure", {})
+        layovers.append(f"{arr.get('iataCode','N/A')} {_format_time(arr.get('at',''))} → {_format_time(dep.get('at',''))}")
+
+    first_segment = segments[0]
+    last_segment = segments[-1]
+    departure = first_segment.get("departure", {})
+    arrival = last_segment.get("arrival", {})
+
+    return {
+        "airline": first_segment.get("carrierCode", "N/A"),
+        "flight_number": first_segment.get("number", "N/A"),
+        "departure_airport": departure.get("iataCode", "N/A"),
+        "arrival_airport": arrival.get("iataCode", "N/A"),
+        "departure_time": _format_time(departure.get("at", "")),
+        "arrival_time": _format_time(arrival.get("at", "")),
+        "duration": _format_duration(itinerary.get("duration", "")),
+        "stops": len(layovers),
+        "layovers": layovers,
+    }
+
+
 def display_results_node(state: FlightSearchState) -> FlightSearchState:
     """Format flight results for display with outbound and return legs."""
     try:
@@ -518,65 +749,6 @@ def display_results_node(state: FlightSearchState) -> FlightSearchState:
     except Exception:
         pass
 
-    def format_duration(duration_str):
-        if not duration_str or not duration_str.startswith('PT'):
-            return duration_str
-        duration_str = duration_str[2:]
-        hours = 0
-        minutes = 0
-        if 'H' in duration_str:
-            hours_part = duration_str.split('H')[0]
-            hours = int(hours_part) if hours_part.isdigit() else 0
-            duration_str = duration_str.split('H')[1] if 'H' in duration_str else duration_str
-        if 'M' in duration_str:
-            minutes_part = duration_str.split('M')[0]
-            minutes = int(minutes_part) if minutes_part.isdigit() else 0
-        if hours > 0 and minutes > 0:
-            return f"{hours}h {minutes}m"
-        elif hours > 0:
-            return f"{hours}h"
-        elif minutes > 0:
-            return f"{minutes}m"
-        else:
-            return "N/A"
-
-    def format_time(datetime_str):
-        if not datetime_str:
-            return "N/A"
-        try:
-            dt = datetime.fromisoformat(datetime_str.replace('Z', '+00:00'))
-            return dt.strftime('%H:%M')
-        except:
-            return datetime_str
-
-    def build_leg(itinerary) -> Dict[str, Any]:
-        segments = itinerary.get("segments", [])
-        if not segments:
-            return None
-            
-        layovers = []
-        for i in range(len(segments) - 1):
-            arr = segments[i].get("arrival", {})
-            dep = segments[i+1].get("departure", {})
-            layovers.append(f"{arr.get('iataCode','N/A')} {format_time(arr.get('at',''))} → {format_time(dep.get('at',''))}")
-            
-        first_segment = segments[0]
-        last_segment = segments[-1]
-        departure = first_segment.get("departure", {})
-        arrival = last_segment.get("arrival", {})
-        
-        return {
-            "airline": first_segment.get("carrierCode", "N/A"),
-            "flight_number": first_segment.get("number", "N/A"),
-            "departure_airport": departure.get("iataCode", "N/A"),
-            "arrival_airport": arrival.get("iataCode", "N/A"),
-            "departure_time": format_time(departure.get("at", "")),
-            "arrival_time": format_time(arrival.get("at", "")),
-            "duration": format_duration(itinerary.get("duration", "")),
-            "stops": max(0, len(segments) - 1),
-            "layovers": layovers,
-        }
-
     try:
         flights = state.get("result", {}).get("data", [])
         if not flights:
@@ -591,8 +763,8 @@ def display_results_node(state: FlightSearchState) -> FlightSearchState:
             if not itineraries:
                 continue
                 
-            outbound_leg = build_leg(itineraries[0])
-            return_leg = build_leg(itineraries[1]) if len(itineraries) > 1 else None
+            outbound_leg = _build_leg(itineraries[0])
+            return_leg = _build_leg(itineraries[1]) if len(itineraries) > 1 else None
             price = flight.get("price", {})
             
             formatted.append({
@@ -618,8 +790,17 @@ def display_results_node(state: FlightSearchState) -> FlightSearchState:
     return state
 
 
-def summarize_node(state: FlightSearchState) -> FlightSearchState:
-    """Generate LLM summary and recommendation."""
+# Flight fields forwarded to the summary prompt. offer_id is left out on
+# purpose: select_flight_offer_node renumbers offers for the user.
+_SUMMARY_KEYS = ("price", "currency", "search_date", "outbound", "return_leg")
+
+
+def summarize_node(state: FlightSearchState, config: Optional[RunnableConfig] = None) -> FlightSearchState:
+    """Generate LLM summary and recommendation.
+
+    When the caller passes an ``on_token`` callable in ``config["configurable"]``
+    the summary is streamed and each chunk is forwarded to it as it arrives.
+    """
     try:
         (state.setdefault("node_trace", [])).append("summarize")
     except Exception:
@@ -631,6 +812,12 @@ def summarize_node(state: FlightSearchState) -> FlightSearchState:
             state["current_node"] = "summarize"
             return state
         
+        # Only the fields the summary talks about go into the prompt
+        compact_results = [
+            {k: f.get(k) for k in _SUMMARY_KEYS}
+            for f in state.get('formatted_results', [])[:3]
+        ]
+
         summary_prompt = f"""You are a helpful travel assistant. Based on the flight search results, provide a concise, friendly summary and recommendation.
 
 Search Details:
@@ -643,7 +830,7 @@ Search Details:
 Found {len(state.get('formatted_results', []))} flight options across 3 days.
 
 Flight Results (sorted by price):
-{json.dumps(state.get('formatted_results', [])[:3], indent=2)}
+{orjson.dumps(compact_results, option=orjson.OPT_INDENT_2).decode()}
 
 Please provide:
 1. A brief, enthusiastic summary of the search results
@@ -654,8 +841,18 @@ Please provide:
 Keep it conversational, helpful, and limit to 2-3 paragraphs. Start with something like "Great! I found several flight options for your trip..."
 """
 
-        summary_response = get_llm().invoke([HumanMessage(content=summary_prompt)])
-        state["summary"] = summary_response.content
+        messages = [HumanMessage(content=summary_prompt)]
+        on_token = ((config or {}).get("configurable") or {}).get("on_token")
+        if on_token:
+            chunks = []
+            for chunk in get_llm().stream(messages):
+                if chunk.content:
+                    chunks.append(chunk.content)
+                    on_token(chunk.content)
+            state["summary"] = "".join(chunks)
+        else:
+            summary_response = get_llm().invoke(messages)
+            state["summary"] = summary_response.content
         
     except Exception as e:
         print(f"Error generating summary: {e}")
@@ -696,20 +893,21 @@ def select_flight_offer_node(state: FlightSearchState) -> FlightSearchState:
                 offers_by_date[search_date].append(offer)
         
         # Debug: Show what we found
-        print(f"[DEBUG] Found offers for {len(offers_by_date)} different dates")
-        for date, offers in offers_by_date.items():
-            print(f"[DEBUG] Date {date}: {len(offers)} offers, prices: {[o.get('price') for o in offers[:3]]}")
+        if DEBUG:
+            print(f"[DEBUG] Found offers for {len(offers_by_date)} different dates")
+            for date, offers in offers_by_date.items():
+                print(f"[DEBUG] Date {date}: {len(offers)} offers, prices: {[o.get('price') for o in offers[:3]]}")
         
         # Find the cheapest offer for each date
         cheapest_by_date = {}
         for date, offers in offers_by_date.items():
-            # Sort by price and take the cheapest
+            # Take the cheapest in one pass
             valid_offers = [o for o in offers if o.get("price") != "N/A" and o.get("price") is not None]
             if valid_offers:
-                sorted_offers = sorted(valid_offers, key=lambda x: float(x.get("price", 0)))
-                cheapest_by_date[date] = sorted_offers[0]
-                print(f"[DEBUG] Cheapest for {date}: {sorted_offers[0].get('price')}")
-            else:
+                cheapest_by_date[date] = min(valid_offers, key=lambda x: float(x.get("price", 0)))
+                if DEBUG:
+                    print(f"[DEBUG] Cheapest for {date}: {cheapest_by_date[date].get('price')}")
+            elif DEBUG:
                 print(f"[DEBUG] No valid offers for {date}")
         
         # Sort dates to find the selected day and next 4 days
@@ -754,32 +952,32 @@ def select_flight_offer_node(state: FlightSearchState) -> FlightSearchState:
         state["all_offers"] = final_offers
         
         # Create a comprehensive selection prompt with all flight details
-        selection_prompt = f"Here are your flight options with the cheapest offer for each available date ({len(final_offers)} options):\n\n"
+        prompt_parts = [f"Here are your flight options with the cheapest offer for each available date ({len(final_offers)} options):\n\n"]
         
         for offer_data in final_offers:
             details = offer_data["display_details"]
             day_type = offer_data.get("day_type", "unknown")
             day_label = "🌟 SELECTED DAY" if day_type == "selected" else f"📅 Alternative Day {offer_data['date']}"
             
-            selection_prompt += f"**{details['offer_id']}** - {details['price']} ({day_label})\n"
-            selection_prompt += f"  Outbound: {details['outbound_details']['airline']} {details['outbound_details']['flight_number']}\n"
-            selection_prompt += f"  Route: {details['outbound_details']['route']}\n"
-            selection_prompt += f"  Time: {details['outbound_details']['times']}\n"
-            selection_prompt += f"  Duration: {details['outbound_details']['duration']} ({details['outbound_details']['stops']})\n"
+            prompt_parts.append(f"**{details['offer_id']}** - {details['price']} ({day_label})\n")
+            prompt_parts.append(f"  Outbound: {details['outbound_details']['airline']} {details['outbound_details']['flight_number']}\n")
+            prompt_parts.append(f"  Route: {details['outbound_details']['route']}\n")
+            prompt_parts.append(f"  Time: {details['outbound_details']['times']}\n")
+            prompt_parts.append(f"  Duration: {details['outbound_details']['duration']} ({details['outbound_details']['stops']})\n")
             
             if "return_details" in details:
                 return_details = details["return_details"]
-                selection_prompt += f"  Return: {return_details['airline']} {return_details['flight_number']}\n"
-                selection_prompt += f"  Route: {return_details['route']}\n"
-                selection_prompt += f"  Time: {return_details['times']}\n"
-                selection_prompt += f"  Duration: {return_details['duration']} ({return_details['stops']})\n"
+                prompt_parts.append(f"  Return: {return_details['airline']} {return_details['flight_number']}\n")
+                prompt_parts.append(f"  Route: {return_details['route']}\n")
+                prompt_parts.append(f"  Time: {return_details['times']}\n")
+                prompt_parts.append(f"  Duration: {return_details['duration']} ({return_details['stops']})\n")
             
-            selection_prompt += "\n"
+            prompt_parts.append("\n")
         
-        selection_prompt += "Please select which flight offer you'd like to proceed with by entering the Offer ID (e.g., OFFER_001, OFFER_002, etc.)."
+        prompt_parts.append("Please select which flight offer you'd like to proceed with by entering the Offer ID (e.g., OFFER_001, OFFER_002, etc.).")
         
         # Set up the selection prompt
-        state["followup_question"] = selection_prompt
+        state["followup_question"] = "".join(prompt_parts)
         state["needs_followup"] = True
         state["info_complete"] = False  # Reset to allow for selection
         
@@ -863,40 +1061,40 @@ def process_flight_selection_node(state: FlightSearchState) -> FlightSearchState
             
             # Generate comprehensive confirmation message with full flight details
             details = selected_offer["display_details"]
-            confirmation_message = f"Perfect! You've selected **{selected_offer['offer_id']}**.\n\n"
-            confirmation_message += f"**Flight Details:**\n"
-            confirmation_message += f"**Price:** {details['price']}\n"
-            confirmation_message += f"**Travel Date:** {details['search_date']}\n\n"
+            message_parts = [f"Perfect! You've selected **{selected_offer['offer_id']}**.\n\n"]
+            message_parts.append(f"**Flight Details:**\n")
+            message_parts.append(f"**Price:** {details['price']}\n")
+            message_parts.append(f"**Travel Date:** {details['search_date']}\n\n")
             
             # Outbound leg details
             outbound = details["outbound_details"]
-            confirmation_message += f"**Outbound Flight:**\n"
-            confirmation_message += f"  Airline: {outbound['airline']} {outbound['flight_number']}\n"
-            confirmation_message += f"  Route: {outbound['route']}\n"
-            confirmation_message += f"  Departure: {outbound['times']}\n"
-            confirmation_message += f"  Duration: {outbound['duration']}\n"
-            confirmation_message += f"  Stops: {outbound['stops']}\n"
+            message_parts.append(f"**Outbound Flight:**\n")
+            message_parts.append(f"  Airline: {outbound['airline']} {outbound['flight_number']}\n")
+            message_parts.append(f"  Route: {outbound['route']}\n")
+            message_parts.append(f"  Departure: {outbound['times']}\n")
+            message_parts.append(f"  Duration: {outbound['duration']}\n")
+            message_parts.append(f"  Stops: {outbound['stops']}\n")
             
             if outbound['layovers']:
-                confirmation_message += f"  Layovers: {', '.join(outbound['layovers'])}\n"
+                message_parts.append(f"  Layovers: {', '.join(outbound['layovers'])}\n")
             
             # Return leg details if it's a round trip
             if "return_details" in details:
                 return_details = details["return_details"]
-                confirmation_message += f"\n**Return Flight:**\n"
-                confirmation_message += f"  Airline: {return_details['airline']} {return_details['flight_number']}\n"
-                confirmation_message += f"  Route: {return_details['route']}\n"
-                confirmation_message += f"  Departure: {return_details['times']}\n"
-                confirmation_message += f"  Duration: {return_details['duration']}\n"
-                confirmation_message += f"  Stops: {return_details['stops']}\n"
+                message_parts.append(f"\n**Return Flight:**\n")
+                message_parts.append(f"  Airline: {return_details['airline']} {return_details['flight_number']}\n")
+                message_parts.append(f"  Route: {return_details['route']}\n")
+                message_parts.append(f"  Departure: {return_details['times']}\n")
+                message_parts.append(f"  Duration: {return_details['duration']}\n")
+                message_parts.append(f"  Stops: {return_details['stops']}\n")
                 
                 if return_details['layovers']:
-                    confirmation_message += f"  Layovers: {', '.join(return_details['layovers'])}\n"
+                    message_parts.append(f"  Layovers: {', '.join(return_details['layovers'])}\n")
             
-            confirmation_message += f"\nYour flight has been confirmed and saved! 🎉"
+            message_parts.append(f"\nYour flight has been confirmed and saved! 🎉")
             
             # Set final confirmation message
-            state["final_confirmation"] = confirmation_message
+            state["final_confirmation"] = "".join(message_parts)
             
         else:
             # Invalid selection, ask again
@@ -0,0 +1,59 @@
+"""
+Regression check for the rule-based extractor in nodes.py.
+
+Adversarial messages must be handled in milliseconds (the route pattern once
+backtracked catastrophically), and a few known phrasings must parse as expected.
+
+Usage:
+  python scripts/check_rule_parser.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from nodes import _ROUTE_RE, _extract_info_rule_based  # noqa: E402
+
+MAX_SECONDS = 0.05
+
+ADVERSARIAL = [
+    "from a to a " * 400 + "@",
+    "from " + "a" * 5000 + " to " + "b " * 2000 + "@",
+    "from a b c d " * 1000 + " to x",
+]
+
+EXPECTED = [
+    ("from Cairo to Dubai on 2026-12-20 for 5 days economy",
+     {"origin": "Cairo", "destination": "Dubai", "cabin_class": "economy", "duration": 5}),
+    ("from Rio de Janeiro to Dubai, 4 days, biz",
+     {"origin": "Rio De Janeiro", "destination": "Dubai", "cabin_class": "business", "duration": 4}),
+]
+
+
+def main():
+    failures = []
+    for text in ADVERSARIAL:
+        start = time.perf_counter()
+        # Time the raw pattern too: the length cap must not be what keeps this fast
+        list(_ROUTE_RE.finditer(text))
+        _extract_info_rule_based([{"role": "user", "content": text}])
+        elapsed = time.perf_counter() - start
+        if elapsed > MAX_SECONDS:
+            failures.append(f"{len(text)}-char adversarial message took {elapsed:.3f}s")
+
+    for text, expected in EXPECTED:
+        extracted, _ = _extract_info_rule_based([{"role": "user", "content": text}])
+        got = {key: extracted.get(key) for key in expected}
+        if got != expected:
+            failures.append(f"{text!r}: expected {expected}, got {got}")
+
+    for failure in failures:
+        print("FAIL", failure)
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,84 +1,118 @@
+from __future__ import annotations
+
+import asyncio
+import atexit
 import os
+import re
 import sys
 import time
-import json
 import argparse
-from collections import defaultdict
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import groupby
+from typing import List, Dict, Any, Optional
 
+import httpx
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 BASE_URL = os.getenv("BASE_URL", "http://localhost:8000")
 CHAT_URL = f"{BASE_URL}/chat"
 HEALTH_URL = f"{BASE_URL}/health"
 RESET_URL = f"{BASE_URL}/reset"
 CLIENT_TIMEOUT = float(os.getenv("CLIENT_TIMEOUT", "120"))
+# Chat payloads are pre-serialized with orjson, so the content type is set by hand
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# One keep-alive session for every request, so turns reuse the same connection
+SESSION = requests.Session()
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=10, max_retries=Retry(total=2, backoff_factor=0.2))
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+atexit.register(SESSION.close)
+
+
+# (intent, pattern, reply) checked in order; the first match wins. Cities come
+# first so "departure city" is not mistaken for a date question ("depart").
+_REPLY_RULES = [
+    ("cities", re.compile(r"departure city|destination city|origin.*destination|destination.*origin", re.S), "Cairo to Dubai"),
+    ("origin", re.compile(r"which city are you flying from"), "Cairo"),
+    ("destination", re.compile(r"which city are you flying to"), "Dubai"),
+    ("trip_type", re.compile(r"one way|round.*trip|trip.*round", re.S), "round trip"),
+    ("cabin", re.compile(r"cabin|economy|business|first"), "economy"),
+    ("duration", re.compile(r"how many days|stay|duration"), "5 days"),
+    ("date", re.compile(r"date|depart"), "2025-12-20"),
+]
+# Sent when no rule matches: every detail at once
+DEFAULT_REPLY = "Cairo to Dubai, 2025-12-20, round trip, 5 days, economy."
+
+
+@lru_cache(maxsize=256)
+def _pick_reply_impl(q_lower: str) -> str:
+    for _intent, pattern, reply in _REPLY_RULES:
+        if pattern.search(q_lower):
+            return reply
+    return DEFAULT_REPLY
 
 
 def pick_reply(question: str) -> str:
-    q = (question or "").lower()
-    # Cities first to avoid matching "depart" in "departure city"
-    if "departure city" in q or "destination city" in q or ("origin" in q and "destination" in q):
-        return "Cairo to Dubai"
-    if "which city are you flying from" in q:
-        return "Cairo"
-    if "which city are you flying to" in q:
-        return "Dubai"
-
-    if "one way" in q or ("round" in q and "trip" in q):
-        return "round trip"
-    if "cabin" in q or "economy" in q or "business" in q or "first" in q:
-        return "economy"
-    if "how many days" in q or "stay" in q or "duration" in q:
-        return "5 days"
-    if "date" in q or "depart" in q:
-        return "2025-12-20"
+    # Follow-up phrasings repeat across turns and runs; cache on the lowered text
+    return _pick_reply_impl((question or "").lower())
 
-    return "Cairo to Dubai, 2025-12-20, round trip, 5 days, economy."
 
+# Fixed layouts for the CLI tables; the last grouped-table column is unpadded
+_LEG_HEADER = (
+    "Price", "Curr", "Leg", "Airline", "Number",
+    "From", "To", "Dep", "Arr", "Dur", "Stops", "Layovers",
+)
+_LEG_WIDTHS = (10, 4, 3, 8, 8, 5, 5, 8, 8, 8, 5)
+_LEG_ROW_FMT = " | ".join([*("{!s:<%d}" % w for w in _LEG_WIDTHS), "{}"])
 
-def tab_row(cols: List[str]) -> str:
-    widths = [max(len(c), 10) for c in cols]
-    return " | ".join(c.ljust(w) for c, w in zip(cols, widths))
+_OFFER_HEADER = ("Offer ID", "Day Type", "Price", "Date", "Outbound", "Return", "Duration", "Stops")
+_OFFER_WIDTHS = (12, 20, 15, 12, 25, 25, 15, 10)
+_OFFER_ROW_FMT = " | ".join("{!s:<%d}" % w for w in _OFFER_WIDTHS)
 
 
 def print_grouped_tables(flights: List[Dict[str, Any]]):
     if not flights:
         print("No flights returned.")
         return
-    by_day: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
-    for f in flights:
-        by_day[f.get('search_date') or 'Unknown'].append(f)
-
-    for day in sorted(by_day.keys()):
-        print(f"\n=== Offers for {day} ===")
-        header = [
-            "Price", "Curr", "Leg", "Airline", "Number",
-            "From", "To", "Dep", "Arr", "Dur", "Stops", "Layovers",
-        ]
-        print(tab_row(header))
-        print("-" * 120)
-        for f in by_day[day]:
+
+    def day_of(f: Dict[str, Any]) -> str:
+        return f.get('search_date') or 'Unknown'
+
+    # Collect the whole table and write it once
+    out: List[str] = []
+    for day, day_flights in groupby(sorted(flights, key=day_of), key=day_of):
+        out.append(f"\n=== Offers for {day} ===")
+        header_row = _LEG_ROW_FMT.format(*_LEG_HEADER)
+        out.append(header_row)
+        out.append("-" * len(header_row))
+        for f in day_flights:
             for leg_key, leg_name in (("outbound", "Out"), ("return_leg", "Ret")):
                 leg = f.get(leg_key)
                 if not leg:
                     continue
                 layovers = "; ".join(leg.get('layovers') or []) or "non-stop"
-                row = [
-                    str(f.get("price", "N/A")),
-                    str(f.get("currency", "USD")),
+                # !s in the row format does the str() conversion
+                out.append(_LEG_ROW_FMT.format(
+                    f.get("price", "N/A"),
+                    f.get("currency", "USD"),
                     leg_name,
-                    str(leg.get("airline", "N/A")),
-                    str(leg.get("flight_number", "N/A")),
-                    str(leg.get("departure_airport", "N/A")),
-                    str(leg.get("arrival_airport", "N/A")),
-                    str(leg.get("departure_time", "N/A")),
-                    str(leg.get("arrival_time", "N/A")),
-                    str(leg.get("duration", "N/A")),
-                    str(leg.get("stops", 0)),
+                    leg.get("airline", "N/A"),
+                    leg.get("flight_number", "N/A"),
+                    leg.get("departure_airport", "N/A"),
+                    leg.get("arrival_airport", "N/A"),
+                    leg.get("departure_time", "N/A"),
+                    leg.get("arrival_time", "N/A"),
+                    leg.get("duration", "N/A"),
+                    leg.get("stops", 0),
                     layovers,
-                ]
-                print(tab_row(row))
+                ))
+    sys.stdout.write("\n".join(out))
+    sys.stdout.write("\n")
 
 
 def print_flight_offers_table(all_offers: List[Dict[str, Any]]):
@@ -87,17 +121,15 @@ def print_flight_offers_table(all_offers: List[Dict[str, Any]]):
         print("No offers available for selection")
         return
     
-    print("\n=== Flight Offers Available ===")
-    print(f"Total offers: {len(all_offers)} (Cheapest offer per day)")
-    
-    # Create table headers
-    headers = ["Offer ID", "Day Type", "Price", "Date", "Outbound", "Return", "Duration", "Stops"]
-    col_widths = [12, 20, 15, 12, 25, 25, 15, 10]
+    # Collect the whole table and write it once
+    out: List[str] = []
+    out.append("\n=== Flight Offers Available ===")
+    out.append(f"Total offers: {len(all_offers)} (Cheapest offer per day)")
     
     # Print header
-    header_row = " | ".join(h.ljust(w) for h, w in zip(headers, col_widths))
-    print(header_row)
-    print("-" * len(header_row))
+    header_row = _OFFER_ROW_FMT.format(*_OFFER_HEADER)
+    out.append(header_row)
+    out.append("-" * len(header_row))
     
     # Print each offer as a row
     for offer in all_offers:
@@ -141,63 +173,64 @@ def print_flight_offers_table(all_offers: List[Dict[str, Any]]):
         stops_str = f"Out: {outbound_stops}\nRet: {return_stops}"
         
         # Create the row
-        row = [
-            offer_id.ljust(col_widths[0]),
-            day_label.ljust(col_widths[1]),
-            str(price).ljust(col_widths[2]),
-            str(search_date).ljust(col_widths[3]),
-            outbound_str.ljust(col_widths[4]),
-            return_str.ljust(col_widths[5]),
-            duration_str.ljust(col_widths[6]),
-            stops_str.ljust(col_widths[7])
-        ]
-        
-        print(" | ".join(row))
-        print("-" * len(header_row))
+        out.append(_OFFER_ROW_FMT.format(
+            offer_id, day_label, price, search_date,
+            outbound_str, return_str, duration_str, stops_str,
+        ))
+        out.append("-" * len(header_row))
     
-    print(f"\n💡 Tip: Select the offer that best fits your schedule and budget!")
+    out.append(f"\n💡 Tip: Select the offer that best fits your schedule and budget!")
+    sys.stdout.write("\n".join(out))
+    sys.stdout.write("\n")
 
 
-def run_auto():
-    # Optional: health check
-    try:
-        r = requests.get(HEALTH_URL, timeout=min(CLIENT_TIMEOUT, 10))
-        print("Health:", r.json())
-    except Exception as e:
-        print("Warning: health check failed:", e)
+async def run_auto_async(client: httpx.AsyncClient, label: Optional[str] = None):
+    # Tag output lines when several conversations share the terminal
+    tag = f"[{label}] " if label else ""
+    # The server keeps this conversation's history under the thread_id it issues
+    # on the first turn, so each turn only sends the new message
+    thread_id = None
+
+    # Optional: health check, run alongside the first chat turn since only its printout depends on it
+    health_task = asyncio.create_task(client.get("/health", timeout=min(CLIENT_TIMEOUT, 10)))
 
-    conversation_history: List[Dict[str, str]] = []
     user_message = "i want to travel from cairo to dubai"
 
     for step in range(1, 12):
         payload = {
             "message": user_message,
-            "conversation_history": conversation_history,
+            "thread_id": thread_id,
         }
-        resp = requests.post(CHAT_URL, json=payload, timeout=CLIENT_TIMEOUT)
+        t0 = time.perf_counter()
+        resp = await client.post("/chat", content=orjson.dumps(payload), headers=JSON_HEADERS)
+        rtt = time.perf_counter() - t0
+        if health_task is not None:
+            try:
+                r = await health_task
+                print(f"{tag}Health:", orjson.loads(r.content))
+            except Exception as e:
+                print(f"{tag}Warning: health check failed:", e)
+            health_task = None
         if resp.status_code != 200:
-            print("Request failed", resp.status_code, resp.text)
-            sys.exit(1)
-        data = resp.json()
+            # Raised rather than exiting so parallel conversations keep running; _main reports it
+            raise RuntimeError(f"Request failed {resp.status_code} {resp.text}")
+        data = orjson.loads(resp.content)
+        thread_id = data.get("thread_id") or thread_id
 
         rtype = data.get("response_type")
         trace = data.get("debug_trace") or []
-        print(f"\nStep {step} -> response_type={rtype}  nodes={trace}")
+        print(f"\n{tag}Step {step} -> response_type={rtype}  nodes={trace}")
 
         assistant_message = data.get("message", "")
-        print("Assistant:", assistant_message)
-
-        # Persist the turn so server is stateful across requests
-        conversation_history.append({"role": "user", "content": user_message})
-        conversation_history.append({"role": "assistant", "content": assistant_message})
+        print(f"{tag}Assistant:", assistant_message)
 
         if rtype == "results":
             flights = data.get("flights", [])
             print_grouped_tables([f for f in flights if f])
             summary = data.get("summary")
             if summary:
-                print("\nSummary:\n", summary)
-            print("\nDone.")
+                print(f"\n{tag}Summary:\n", summary)
+            print(f"\n{tag}Done.")
             return
         elif rtype == "selection":
             # Handle flight selection
@@ -206,32 +239,36 @@ def run_auto():
                 print_flight_offers_table(all_offers)
                 # Auto-select the first offer for testing
                 user_message = all_offers[0]["offer_id"]
-                print(f"\nAuto-selecting: {user_message}")
+                print(f"\n{tag}Auto-selecting: {user_message}")
             else:
-                print("No offers available for selection")
+                print(f"{tag}No offers available for selection")
                 return
         elif rtype == "confirmation":
-            print("Flight selection confirmed!")
+            print(f"{tag}Flight selection confirmed!")
             return
 
         # Otherwise, answer the follow-up
         user_message = pick_reply(assistant_message)
-        print("User:", user_message)
-        time.sleep(0.3)
+        print(f"{tag}User:", user_message)
+        # Keep turns at least 300ms apart; slow responses already cover that
+        await asyncio.sleep(max(0.0, 0.3 - rtt))
 
-    print("Reached step limit without results. Check API keys and server logs.")
+    print(f"{tag}Reached step limit without results. Check API keys and server logs.")
 
 
 def run_interactive():
+    # Health check starts in the background; its result is shown before the first prompt
+    health_pool = ThreadPoolExecutor(max_workers=1)
+    health_future = health_pool.submit(SESSION.get, HEALTH_URL, timeout=min(CLIENT_TIMEOUT, 10))
+    health_pool.shutdown(wait=False)
     print("Flight Search CLI (type /quit to exit, /reset to reset conversation)")
-    # Health
     try:
-        r = requests.get(HEALTH_URL, timeout=min(CLIENT_TIMEOUT, 10))
-        print("Health:", r.json())
+        print("Health:", orjson.loads(health_future.result(timeout=min(CLIENT_TIMEOUT, 10)).content))
     except Exception as e:
         print("Warning: health check failed:", e)
 
-    conversation_history: List[Dict[str, str]] = []
+    # The server keeps the history under the thread_id it issues; /reset starts a new one
+    thread_id = None
     try:
         while True:
             user_message = input("You: ").strip()
@@ -241,28 +278,28 @@ def run_interactive():
                 print("Bye!")
                 return
             if user_message.lower() == "/reset":
-                try:
-                    requests.post(RESET_URL, timeout=min(CLIENT_TIMEOUT, 10))
-                except Exception:
-                    pass
-                conversation_history.clear()
+                # Best-effort cleanup of the old thread; dropping the id is what resets the conversation
+                if thread_id:
+                    try:
+                        SESSION.post(RESET_URL, params={"thread_id": thread_id}, timeout=min(CLIENT_TIMEOUT, 10))
+                    except Exception:
+                        pass
+                thread_id = None
                 print("Conversation reset.")
                 continue
 
             payload = {
                 "message": user_message,
-                "conversation_history": conversation_history,
+                "thread_id": thread_id,
             }
-            resp = requests.post(CHAT_URL, json=payload, timeout=CLIENT_TIMEOUT)
+            resp = SESSION.post(CHAT_URL, data=orjson.dumps(payload), headers=JSON_HEADERS, timeout=CLIENT_TIMEOUT)
             if resp.status_code != 200:
                 print("Request failed", resp.status_code, resp.text)
                 continue
-            data = resp.json()
+            data = orjson.loads(resp.content)
+            thread_id = data.get("thread_id") or thread_id
 
-            # Persist the turn
-            conversation_history.append({"role": "user", "content": user_message})
             assistant_message = data.get("message", "")
-            conversation_history.append({"role": "assistant", "content": assistant_message})
 
             rtype = data.get("response_type")
             trace = data.get("debug_trace") or []
@@ -292,13 +329,30 @@ def run_interactive():
         print("\nBye!")
 
 
+async def _main(concurrency: int = 1) -> int:
+    # A single client keeps one connection (multiplexed over HTTP/2 when the
+    # server offers it) for health + every chat turn, shared by all conversations
+    limits = httpx.Limits(max_keepalive_connections=concurrency * 2)
+    async with httpx.AsyncClient(http2=True, base_url=BASE_URL, timeout=CLIENT_TIMEOUT, limits=limits) as client:
+        labels = [None] if concurrency == 1 else [f"t{i}" for i in range(concurrency)]
+        # A failing conversation doesn't cancel the others; failures are reported once all finish
+        results = await asyncio.gather(*(run_auto_async(client, label=label) for label in labels), return_exceptions=True)
+    failures = [(label, result) for label, result in zip(labels, results) if isinstance(result, BaseException)]
+    for label, error in failures:
+        tag = f"[{label}] " if label else ""
+        print(f"{tag}Failed: {error}")
+    return len(failures)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Flight Search Chat CLI")
     parser.add_argument("--auto", action="store_true", help="Run in auto mode (no interactive input)")
+    parser.add_argument("--concurrency", type=int, default=1, help="Auto mode: number of conversations to run in parallel")
     args = parser.parse_args()
 
     if args.auto:
-        run_auto()
+        if asyncio.run(_main(max(1, args.concurrency))):
+            sys.exit(1)
     else:
         run_interactive()
 
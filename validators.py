@@ -1,7 +1,27 @@
 import re
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from functools import lru_cache, wraps
 from typing import Dict, Tuple, List, Optional
 
+_DIGITS_RE = re.compile(r'\d+')
+_ISO_DATE_RE = re.compile(r'(\d{4})-(\d{2})-(\d{2})$', re.ASCII)
+
+def _cached(func):
+    """lru_cache for the validators; unhashable arguments (e.g. a list from the LLM) skip the cache"""
+    cached_func = lru_cache(maxsize=256)(func)
+
+    @wraps(func)
+    def wrapper(*args):
+        try:
+            hash(args)
+        except TypeError:
+            return func(*args)
+        return cached_func(*args)
+
+    wrapper.cache_info = cached_func.cache_info
+    wrapper.cache_clear = cached_func.cache_clear
+    return wrapper
+
 def validate_extracted_info(extracted_info: dict) -> Tuple[dict, List[str]]:
     """Validate extracted information and return cleaned data + validation errors"""
     validated_info = {}
@@ -15,63 +35,49 @@ def validate_extracted_info(extracted_info: dict) -> Tuple[dict, List[str]]:
         else:
             errors.append(f"Date issue: {date_validation['error']}")
     
-    # Validate origin and destination
-    for location_field in ['origin', 'destination']:
-        if extracted_info.get(location_field):
-            location = extracted_info[location_field].strip()
-            if len(location) >= 2:  # Basic validation
-                validated_info[location_field] = location.title()
+    # Validate the remaining fields in order; each validator returns the cleaned value or None
+    for field, validator, error in _FIELD_VALIDATORS:
+        if extracted_info.get(field):
+            value = validator(extracted_info[field])
+            if value:
+                validated_info[field] = value
             else:
-                errors.append(f"Invalid {location_field}: too short")
-    
-    # Validate cabin class
-    if extracted_info.get('cabin_class'):
-        cabin = validate_cabin_class(extracted_info['cabin_class'])
-        if cabin:
-            validated_info['cabin_class'] = cabin
-        else:
-            errors.append("Invalid cabin class. Must be economy, business, or first class")
-    
-    # Validate trip type
-    if extracted_info.get('trip_type'):
-        trip_type = validate_trip_type(extracted_info['trip_type'])
-        if trip_type:
-            validated_info['trip_type'] = trip_type
-        else:
-            errors.append("Invalid trip type. Must be 'one way' or 'round trip'")
-    
-    # Validate duration
-    if extracted_info.get('duration'):
-        duration = validate_duration(extracted_info['duration'])
-        if duration:
-            validated_info['duration'] = duration
-        else:
-            errors.append("Invalid duration. Must be a positive number of days")
+                errors.append(error)
     
     return validated_info, errors
 
+# Tried in order; the first format that parses wins
+_DATE_FORMATS = (
+    "%Y-%m-%d", "%m/%d/%Y", "%d/%m/%Y", "%m-%d-%Y",
+    "%B %d, %Y", "%B %d", "%b %d", "%m/%d", "%d/%m"
+)
+
 def validate_date(date_str: str) -> Dict[str, any]:
     """Validate and parse date string"""
-    date_formats = [
-        "%Y-%m-%d", "%m/%d/%Y", "%d/%m/%Y", "%m-%d-%Y", 
-        "%B %d, %Y", "%B %d", "%b %d", "%m/%d", "%d/%m"
-    ]
-    
-    current_year = datetime.now().year
-    today = datetime.now().date()
+    # Copy so callers can't mutate the cached result
+    return dict(_validate_date_on(date_str, datetime.now().date()))
+
+@_cached
+def _validate_date_on(date_str: str, today: date) -> Dict[str, any]:
+    """validate_date relative to a given day; keyed on it so results roll over at midnight"""
+    date_text = date_str.strip()
+    iso_match = _ISO_DATE_RE.match(date_text)
     
-    for fmt in date_formats:
+    for fmt in _DATE_FORMATS:
         try:
-            parsed_date = datetime.strptime(date_str.strip(), fmt).date()
+            if iso_match and fmt == "%Y-%m-%d":
+                # Fast path for ASCII YYYY-MM-DD; date() rejects the same values strptime would
+                parsed_date = date(int(iso_match[1]), int(iso_match[2]), int(iso_match[3]))
+            else:
+                parsed_date = datetime.strptime(date_text, fmt).date()
             
             # If no year provided, assume current year
             if parsed_date.year == 1900:  # Default year for formats without year
-                parsed_date = parsed_date.replace(year=current_year)
+                parsed_date = parsed_date.replace(year=today.year)
             
-            # If date is in the past, try next year
-            if parsed_date < today:
-                if parsed_date.month < today.month or (parsed_date.month == today.month and parsed_date.day < today.day):
-                    parsed_date = parsed_date.replace(year=current_year + 1)
+            # If date is in the past and its month/day has already gone by this year, try next year
+            if parsed_date < today and (parsed_date.month, parsed_date.day) < (today.month, today.day):
+                parsed_date = parsed_date.replace(year=today.year + 1)
             
             # Check if date is too far in the future (more than 2 years)
             if parsed_date > today + timedelta(days=730):
@@ -84,36 +90,59 @@ def validate_date(date_str: str) -> Dict[str, any]:
     
     return {"valid": False, "error": f"Could not parse date '{date_str}'. Try formats like '2025-12-25' or 'December 25, 2025'"}
 
+_CABIN_MAPPINGS = {
+    'economy': 'economy',
+    'eco': 'economy',
+    'coach': 'economy',
+    'business': 'business',
+    'biz': 'business',
+    'first': 'first class',
+    'first class': 'first class',
+    'premium': 'business'  # Treat premium as business
+}
+
+@_cached
 def validate_cabin_class(cabin_str: str) -> Optional[str]:
     """Validate and normalize cabin class"""
-    cabin_lower = cabin_str.lower().strip()
-    cabin_mappings = {
-        'economy': 'economy',
-        'eco': 'economy',
-        'coach': 'economy',
-        'business': 'business',
-        'biz': 'business',
-        'first': 'first class',
-        'first class': 'first class',
-        'premium': 'business'  # Treat premium as business
-    }
-    return cabin_mappings.get(cabin_lower)
+    return _CABIN_MAPPINGS.get(cabin_str.lower().strip())
 
+# Matched as substrings, so "return flight" or "one way trip" still count
+_ROUND_TRIP_WORDS = ('round', 'return', 'two way', 'roundtrip')
+_ONE_WAY_WORDS = ('one way', 'oneway', 'single')
+
+@_cached
 def validate_trip_type(trip_str: str) -> Optional[str]:
     """Validate and normalize trip type"""
     trip_lower = trip_str.lower().strip()
-    if any(word in trip_lower for word in ['round', 'return', 'two way', 'roundtrip']):
+    if any(word in trip_lower for word in _ROUND_TRIP_WORDS):
         return 'round trip'
-    elif any(word in trip_lower for word in ['one way', 'oneway', 'single']):
+    elif any(word in trip_lower for word in _ONE_WAY_WORDS):
         return 'one way'
     return None
 
+@_cached
 def validate_duration(duration_str: str) -> Optional[int]:
     """Validate and extract duration in days"""
-    # Extract numbers from string
-    numbers = re.findall(r'\d+', str(duration_str))
-    if numbers:
-        duration = int(numbers[0])
+    # Extract the first number from string
+    match = _DIGITS_RE.search(str(duration_str))
+    if match:
+        duration = int(match.group(0))
         if 1 <= duration <= 365:  # Reasonable range
             return duration
-    return None
\ No newline at end of file
+    return None
+
+def _validate_location(location: str) -> Optional[str]:
+    """Title-case a location name, or None if it is too short to be one"""
+    location = location.strip()
+    if len(location) >= 2:  # Basic validation
+        return location.title()
+    return None
+
+# (field, validator, error) checked in this order by validate_extracted_info after the date
+_FIELD_VALIDATORS = (
+    ('origin', _validate_location, "Invalid origin: too short"),
+    ('destination', _validate_location, "Invalid destination: too short"),
+    ('cabin_class', validate_cabin_class, "Invalid cabin class. Must be economy, business, or first class"),
+    ('trip_type', validate_trip_type, "Invalid trip type. Must be 'one way' or 'round trip'"),
+    ('duration', validate_duration, "Invalid duration. Must be a positive number of days"),
+)